@@ -4,7 +4,7 @@ create_search_index.py
 Creates (or recreates) the Azure AI Search index used by Ops Assistant.
 
 Requirements:
-  pip install azure-search-documents
+  pip install "azure-search-documents>=11.6"
 
 Env vars (required):
   AZURE_SEARCH_ENDPOINT=https://<your-search>.search.windows.net
@@ -14,6 +14,10 @@ Env vars (optional):
   AZURE_SEARCH_INDEX=opsassistant-docs
   EMBEDDING_DIM=3072   # text-embedding-3-large default; use 1536 for text-embedding-3-small
   RECREATE_INDEX=true  # delete + recreate if exists
+  HNSW_M=10            # graph links per node (4-10); higher = better recall, memory grows ~linearly
+  HNSW_EFC=200         # efConstruction (100-1000); build-time candidate list, affects indexing time only
+  HNSW_EFS=100         # efSearch (100-1000); query-time candidate list, trades latency for recall
+  SCALAR_QUANTIZATION=true  # int8-compress the HNSW vectors (~4x less vector memory), rescored with originals
 """
 
 import os
@@ -29,7 +33,10 @@ from azure.search.documents.indexes.models import (
     VectorSearchProfile,
     HnswAlgorithmConfiguration,
     HnswParameters,
-    SemanticSettings,
+    ScalarQuantizationCompression,
+    ScalarQuantizationParameters,
+    RescoringOptions,
+    SemanticSearch,
     SemanticConfiguration,
     SemanticField,
     SemanticPrioritizedFields,
@@ -40,6 +47,10 @@ SEARCH_KEY = os.getenv("AZURE_SEARCH_KEY")
 INDEX_NAME = os.getenv("AZURE_SEARCH_INDEX", "opsassistant-docs")
 EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "3072"))
 RECREATE = os.getenv("RECREATE_INDEX", "false").lower() in ("1", "true", "yes", "y")
+HNSW_M = int(os.getenv("HNSW_M", "10"))
+HNSW_EFC = int(os.getenv("HNSW_EFC", "200"))
+HNSW_EFS = int(os.getenv("HNSW_EFS", "100"))
+SCALAR_QUANTIZATION = os.getenv("SCALAR_QUANTIZATION", "true").lower() in ("1", "true", "yes", "y")
 
 if not SEARCH_ENDPOINT or not SEARCH_KEY:
     raise SystemExit("Missing AZURE_SEARCH_ENDPOINT or AZURE_SEARCH_KEY")
@@ -49,6 +60,7 @@ client = SearchIndexClient(endpoint=SEARCH_ENDPOINT, credential=credential)
 
 VECTOR_PROFILE_NAME = "content-vector-profile"
 HNSW_CONFIG_NAME = "hnsw-config"
+COMPRESSION_NAME = "sq-config"
 
 
 def index_exists(name: str) -> bool:
@@ -96,22 +108,38 @@ def build_index() -> SearchIndex:
             HnswAlgorithmConfiguration(
                 name=HNSW_CONFIG_NAME,
                 parameters=HnswParameters(
-                    m=4,
-                    ef_construction=200,
-                    ef_search=100,
-                    metric="cosine",
+                    m=HNSW_M,
+                    ef_construction=HNSW_EFC,
+                    ef_search=HNSW_EFS,
+                    # Embeddings are unit-normalized at ingest/query time, so
+                    # dotProduct ranks like cosine without per-distance norms.
+                    metric="dotProduct",
                 ),
             )
         ],
+        compressions=[
+            # int8 quantized vectors back the HNSW graph; the full-precision
+            # originals are kept so the top candidates can be rescored.
+            ScalarQuantizationCompression(
+                compression_name=COMPRESSION_NAME,
+                parameters=ScalarQuantizationParameters(quantized_data_type="int8"),
+                rescoring_options=RescoringOptions(
+                    enable_rescoring=True,
+                    default_oversampling=4.0,
+                    rescore_storage_method="preserveOriginals",
+                ),
+            )
+        ] if SCALAR_QUANTIZATION else None,
         profiles=[
             VectorSearchProfile(
                 name=VECTOR_PROFILE_NAME,
                 algorithm_configuration_name=HNSW_CONFIG_NAME,
+                compression_name=COMPRESSION_NAME if SCALAR_QUANTIZATION else None,
             )
         ],
     )
 
-    semantic = SemanticSettings(
+    semantic = SemanticSearch(
         configurations=[
             SemanticConfiguration(
                 name="semantic-config",
@@ -131,7 +159,7 @@ def build_index() -> SearchIndex:
         name=INDEX_NAME,
         fields=fields,
         vector_search=vector_search,
-        semantic_settings=semantic,
+        semantic_search=semantic,
     )
 
 
@@ -152,7 +180,8 @@ def main():
     print(f"Created index: {INDEX_NAME}")
     print(f"Vector dims: {EMBEDDING_DIM}")
     print(f"Vector profile: {VECTOR_PROFILE_NAME}")
-    print(f"HNSW config: {HNSW_CONFIG_NAME}")
+    print(f"Compression: {COMPRESSION_NAME if SCALAR_QUANTIZATION else 'none'}")
+    print(f"HNSW config: {HNSW_CONFIG_NAME} (m={HNSW_M}, efConstruction={HNSW_EFC}, efSearch={HNSW_EFS})")
 
 
 if __name__ == "__main__":
@@ -161,5 +190,11 @@ if __name__ == "__main__":
 """
 Notes:
 - Set EMBEDDING_DIM=3072 for text-embedding-3-large or 1536 for text-embedding-3-small.
+  text-embedding-3-small halves vector storage and upload payloads; pair it with
+  AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT pointing at a small deployment and re-ingest.
 - This script creates a vector-enabled index using Azure AI Search's vector index schema pattern.
+- The HNSW metric is dotProduct; the AI service normalizes every embedding to unit length.
+  Existing cosine indexes must be recreated (RECREATE_INDEX=true) and documents re-ingested.
+- HNSW parameters only apply when the index is created; changing HNSW_* requires recreating it.
+  Azure AI Search caps m at 10, so the default uses the maximum; vector memory grows roughly linearly with m.
 """
@@ -1,31 +1,73 @@
-import os, re, json, math
-from typing import List, Dict, Any, Optional, Literal
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
-import requests
+import os, io, re, math, asyncio, gzip, hashlib, itertools, multiprocessing, uuid
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from string import Template
+from tempfile import SpooledTemporaryFile
+from typing import List, Dict, Any, Optional, Literal, BinaryIO, Tuple, AsyncIterator
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, TypeAdapter, ValidationError
+import httpx
+import orjson
+import json_repair
+from dotenv import load_dotenv
+from cachetools import TTLCache
 
 from docx import Document
 from pypdf import PdfReader
 import openpyxl
 
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient, SearchIndexingBufferedSender
+
+http_client: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=90,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=3,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        ),
+    )
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+        if search_client:
+            await search_client.close()
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(cancel_futures=True)
 
-app = FastAPI(title="Ops Assistant AI")
+class OrjsonResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
 
-# ---------- ENV LOADER ----------
-def load_env(path: str = ".env") -> None:
-    if not os.path.exists(path):
-        return
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#") or "=" not in line:
-                continue
-            k, v = line.split("=", 1)
-            os.environ.setdefault(k, v)
+app = FastAPI(title="Ops Assistant AI", lifespan=lifespan, default_response_class=OrjsonResponse)
 
-load_env()
+# ---------- ENV LOADER ----------
+load_dotenv(".env", override=False)
 
 # ---------- ENV ----------
 SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
@@ -39,16 +81,43 @@ EMB_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT")
 CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT")
 EMB_ENDPOINT = os.getenv("AZURE_OPENAI_EMBEDDINGS_ENDPOINT") or AOAI_ENDPOINT
 CHAT_ENDPOINT = os.getenv("AZURE_OPENAI_CHAT_ENDPOINT") or AOAI_ENDPOINT
+EMB_URL = f"{EMB_ENDPOINT}/openai/deployments/{EMB_DEPLOYMENT}/embeddings?api-version={AOAI_API_VERSION}"
+CHAT_URL = f"{CHAT_ENDPOINT}/openai/deployments/{CHAT_DEPLOYMENT}/chat/completions?api-version={AOAI_API_VERSION}"
+AOAI_HEADERS = {"api-key": AOAI_KEY, "Content-Type": "application/json"}
 MOCK_AI = os.getenv("MOCK_AI", "false").lower() in ("1", "true", "yes", "y")
+EMBED_BATCH_SIZE = max(1, int(os.getenv("AOAI_EMBED_BATCH", "16")))
+EMBED_CONCURRENCY = max(1, int(os.getenv("AOAI_EMBED_CONCURRENCY", "8")))
+SEMANTIC_RERANK = os.getenv("SEARCH_SEMANTIC_RERANK", "false").lower() in ("1", "true", "yes", "y")
+SEMANTIC_CONFIG = os.getenv("SEARCH_SEMANTIC_CONFIG", "semantic-config")
+RERANK_CANDIDATES = int(os.getenv("SEARCH_RERANK_CANDIDATES", "40"))
+INGEST_CACHE_DIR = os.getenv("INGEST_CACHE_DIR", "")
+INGEST_CACHE_VERSION = "2"  # bump when extraction/chunking output changes
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "512"))
+CHUNK_TOKEN_OVERLAP = int(os.getenv("CHUNK_TOKEN_OVERLAP", "64"))
+CHUNK_ENCODING = os.getenv("CHUNK_ENCODING", "cl100k_base")  # text-embedding-3-*, ada-002
+if CHUNK_TOKENS > 0 and not 0 <= CHUNK_TOKEN_OVERLAP < CHUNK_TOKENS:
+    raise ValueError(
+        f"CHUNK_TOKEN_OVERLAP ({CHUNK_TOKEN_OVERLAP}) must be >= 0 and smaller than CHUNK_TOKENS ({CHUNK_TOKENS})"
+    )
+SPOOL_MAX_BYTES = int(os.getenv("INGEST_SPOOL_MAX_MB", "16")) * 1024 * 1024
+AI_WORKERS = int(os.getenv("AI_WORKERS", str(os.cpu_count() or 1)))
+PDF_WORKERS = max(1, int(os.getenv("INGEST_PDF_WORKERS", str(min(4, (os.cpu_count() or 1) // AI_WORKERS)))))
+# ~70 KB of JSON per 3072-dim vector keeps 200-document uploads under the 16 MB request limit.
+SEARCH_UPLOAD_BATCH = max(1, int(os.getenv("SEARCH_UPLOAD_BATCH", "200")))
+META_CACHE_TTL = int(os.getenv("META_CACHE_TTL", "3600"))
+EMB_CACHE_SIZE = int(os.getenv("EMB_CACHE_SIZE", "10000"))
+EMB_CACHE_DIR = os.getenv("EMB_CACHE_DIR", "")
 
 if not all([SEARCH_ENDPOINT, SEARCH_KEY, AOAI_ENDPOINT, AOAI_KEY, EMB_DEPLOYMENT, CHAT_DEPLOYMENT]):
     # allow boot without env in early dev, but endpoints will fail
     pass
 
+search_credential = AzureKeyCredential(SEARCH_KEY) if SEARCH_KEY else None
+
 search_client = SearchClient(
     endpoint=SEARCH_ENDPOINT,
     index_name=SEARCH_INDEX,
-    credential=AzureKeyCredential(SEARCH_KEY)
+    credential=search_credential
 ) if SEARCH_ENDPOINT and SEARCH_KEY else None
 
 # ---------- Models ----------
@@ -131,79 +200,236 @@ class VerificationResponse(BaseModel):
     missing_info: List[str]
     overall_confidence: Literal["low", "medium", "high"]
 
+SOP_ADAPTER = TypeAdapter(SopResponse)
+PROCESS_ADAPTER = TypeAdapter(ProcessResponse)
+VERIFICATION_ADAPTER = TypeAdapter(VerificationResponse)
+
 # ---------- Utilities ----------
-def download_bytes(url: str) -> bytes:
-    r = requests.get(url, timeout=60)
-    r.raise_for_status()
-    return r.content
-
-def extract_chunks(doc_type: str, b: bytes) -> List[Dict[str, Any]]:
-    doc_type = doc_type.lower()
-
-    if doc_type in ["txt", "md"]:
-        return [{"content": b.decode("utf-8", errors="ignore"), "pageNumber": None, "sectionTitle": None}]
-
-    if doc_type in ["docx"]:
-        from io import BytesIO
-        f = BytesIO(b)
-        d = Document(f)
-        chunks = []
-        current_title = None
-        buffer = []
-        for p in d.paragraphs:
-            text = (p.text or "").strip()
-            if not text:
-                continue
-            style = (p.style.name or "").lower() if p.style else ""
-            if style.startswith("heading"):
-                if buffer:
-                    chunks.append({
-                        "content": "\n".join(buffer),
-                        "pageNumber": None,
-                        "sectionTitle": current_title,
-                    })
-                    buffer = []
-                current_title = text
-            else:
-                buffer.append(text)
-        if buffer:
-            chunks.append({
-                "content": "\n".join(buffer),
-                "pageNumber": None,
-                "sectionTitle": current_title,
-            })
-        return chunks or [{"content": "", "pageNumber": None, "sectionTitle": None}]
-
-    if doc_type in ["pdf"]:
-        from io import BytesIO
-        f = BytesIO(b)
-        reader = PdfReader(f)
-        pages = []
-        for idx, p in enumerate(reader.pages):
-            t = p.extract_text() or ""
-            if t.strip():
-                pages.append({
-                    "content": t,
-                    "pageNumber": idx + 1,
-                    "sectionTitle": None,
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def retry_delay(r: httpx.Response, attempt: int) -> float:
+    try:
+        return float(r.headers.get("retry-after", ""))
+    except ValueError:
+        return 0.5 * 2 ** attempt
+
+async def http_request(method: str, url: str, max_retries: int = 5, **kwargs) -> httpx.Response:
+    for attempt in range(max_retries + 1):
+        r = await http_client.request(method, url, **kwargs)
+        if r.status_code not in RETRY_STATUSES or attempt == max_retries:
+            r.raise_for_status()
+            return r
+        await asyncio.sleep(retry_delay(r, attempt))
+
+@asynccontextmanager
+async def http_stream(method: str, url: str, max_retries: int = 5, **kwargs) -> AsyncIterator[httpx.Response]:
+    for attempt in range(max_retries + 1):
+        async with http_client.stream(method, url, **kwargs) as r:
+            if r.status_code not in RETRY_STATUSES or attempt == max_retries:
+                r.raise_for_status()
+                yield r
+                return
+            delay = retry_delay(r, attempt)
+        await asyncio.sleep(delay)
+
+async def download_blob(url: str) -> Tuple[BinaryIO, str]:
+    f = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    digest = hashlib.sha256()
+    try:
+        async with http_stream("GET", url, timeout=60) as r:
+            async for block in r.aiter_bytes(1 << 16):
+                f.write(block)
+                digest.update(block)
+    except Exception:
+        f.close()
+        raise
+    f.seek(0)
+    return f, digest.hexdigest()
+
+def ingest_cache_path(digest: str, doc_type: str) -> Optional[str]:
+    if not INGEST_CACHE_DIR:
+        return None
+    key = hashlib.sha256(
+        f"{INGEST_CACHE_VERSION}|{digest}|{doc_type.lower()}|{EMB_DEPLOYMENT}|{chunker_id()}".encode("utf-8")
+    ).hexdigest()
+    return os.path.join(INGEST_CACHE_DIR, f"{key}.chunks.jsonl.gz")
+
+def valid_cache_entry(path: str) -> bool:
+    # Decompressing to EOF checks the gzip CRC; a damaged entry is dropped and treated as a miss.
+    try:
+        with gzip.open(path, "rb") as fh:
+            while fh.read(1 << 20):
+                pass
+        return True
+    except (OSError, EOFError):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+def _read_records(fh, n: int) -> List[Dict[str, Any]]:
+    return [orjson.loads(line) for line in itertools.islice(fh, n)]
+
+async def cached_records(path: str) -> AsyncIterator[Dict[str, Any]]:
+    with gzip.open(path, "rb") as fh:
+        while True:
+            records = await run_in_threadpool(_read_records, fh, 64)
+            if not records:
+                break
+            for record in records:
+                yield record
+
+@asynccontextmanager
+async def ingest_cache_writer(path: Optional[str]):
+    # Yields an async write(records); the entry is only published if the block completes.
+    fh = None
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp" if path else None
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fh = await run_in_threadpool(gzip.open, tmp, "wb", compresslevel=1)
+        except OSError:
+            fh = None
+
+    def write_lines(out, records: List[Dict[str, Any]]) -> None:
+        out.write(b"".join(orjson.dumps(r) + b"\n" for r in records))
+
+    async def write(records: List[Dict[str, Any]]) -> None:
+        nonlocal fh
+        if fh is None:
+            return
+        try:
+            await run_in_threadpool(write_lines, fh, records)
+        except OSError:
+            fh.close()
+            fh = None
+
+    try:
+        yield write
+        if fh is not None:
+            done, fh = fh, None
+            try:
+                await run_in_threadpool(done.close)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+    finally:
+        if fh is not None:
+            fh.close()
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+def extract_text(f: BinaryIO) -> List[Dict[str, Any]]:
+    text = f.read().decode("utf-8", errors="ignore")
+    if not text.strip():
+        return []
+    return [{"content": text, "pageNumber": None, "sectionTitle": None}]
+
+def extract_docx(f: BinaryIO) -> List[Dict[str, Any]]:
+    d = Document(f)
+    chunks = []
+    current_title = None
+    buffer = []
+    for p in d.paragraphs:
+        text = (p.text or "").strip()
+        if not text:
+            continue
+        style = (p.style.name or "").lower() if p.style else ""
+        if style.startswith("heading"):
+            if buffer:
+                chunks.append({
+                    "content": "\n".join(buffer),
+                    "pageNumber": None,
+                    "sectionTitle": current_title,
                 })
-        return pages or [{"content": "", "pageNumber": None, "sectionTitle": None}]
+                buffer = []
+            current_title = text
+        else:
+            buffer.append(text)
+    if buffer:
+        chunks.append({
+            "content": "\n".join(buffer),
+            "pageNumber": None,
+            "sectionTitle": current_title,
+        })
+    return chunks or [{"content": "", "pageNumber": None, "sectionTitle": None}]
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+def _extract_pdf_pages(data: bytes, start: int, stop: int) -> List[str]:
+    reader = PdfReader(io.BytesIO(data))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def extract_pdf_pages(f: BinaryIO) -> List[str]:
+    global _pdf_pool
+    reader = PdfReader(f)
+    n = len(reader.pages)
+    if PDF_WORKERS <= 1 or n < 2 * PDF_WORKERS:
+        return [p.extract_text() or "" for p in reader.pages]
+    f.seek(0)
+    data = f.read()
+    if _pdf_pool is None:
+        # spawn: forking a process that already runs threads is unsafe.
+        _pdf_pool = ProcessPoolExecutor(PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    step = -(-n // PDF_WORKERS)
+    starts = range(0, n, step)
+    parts = _pdf_pool.map(
+        _extract_pdf_pages,
+        itertools.repeat(data),
+        starts,
+        (min(start + step, n) for start in starts),
+    )
+    return list(itertools.chain.from_iterable(parts))
+
+def extract_pdf(f: BinaryIO) -> List[Dict[str, Any]]:
+    if pymupdf is not None:
+        with pymupdf.open(stream=f.read(), filetype="pdf") as pdf:
+            texts = [p.get_text() for p in pdf]
+    else:
+        texts = extract_pdf_pages(f)
+    pages = []
+    for idx, t in enumerate(texts):
+        if t.strip():
+            pages.append({
+                "content": t,
+                "pageNumber": idx + 1,
+                "sectionTitle": None,
+            })
+    return pages or [{"content": "", "pageNumber": None, "sectionTitle": None}]
 
-    if doc_type in ["xlsx"]:
-        from io import BytesIO
-        f = BytesIO(b)
-        wb = openpyxl.load_workbook(f, data_only=True)
-        chunks = []
+def extract_xlsx(f: BinaryIO) -> List[Dict[str, Any]]:
+    wb = openpyxl.load_workbook(f, data_only=True, read_only=True)
+    chunks = []
+    try:
         for ws in wb.worksheets:
             chunks.append(f"Sheet: {ws.title}")
             for row in ws.iter_rows(values_only=True):
-                line = "\t".join([str(c) for c in row if c is not None])
+                line = "\t".join(str(c) for c in row if c is not None)
                 if line.strip():
                     chunks.append(line)
-        return [{"content": "\n".join(chunks), "pageNumber": None, "sectionTitle": None}]
-
+    finally:
+        wb.close()
+    return [{"content": "\n".join(chunks), "pageNumber": None, "sectionTitle": None}]
+
+EXTRACTORS = {
+    "txt": extract_text,
+    "md": extract_text,
+    "docx": extract_docx,
+    "pdf": extract_pdf,
+    "xlsx": extract_xlsx,
+}
+
+def extract_chunks(doc_type: str, f: BinaryIO) -> List[Dict[str, Any]]:
     # Google Docs exports will typically be docx or pdf; treat unknown as text
-    return [{"content": b.decode("utf-8", errors="ignore"), "pageNumber": None, "sectionTitle": None}]
+    return EXTRACTORS.get(doc_type.lower(), extract_text)(f)
+
+_NL3 = re.compile(r"\n{3,}")
+
+def collapse_blank_lines(text: str) -> str:
+    if "\n\n\n" in text:
+        text = _NL3.sub("\n\n", text)
+    return text.strip()
 
 def chunk_text_with_meta(
     chunks: List[Dict[str, Any]],
@@ -212,93 +438,252 @@ def chunk_text_with_meta(
 ) -> List[Dict[str, Any]]:
     out = []
     for item in chunks:
-        text = re.sub(r"\n{3,}", "\n\n", (item.get("content") or "")).strip()
-        if not text:
-            continue
-        i = 0
-        while i < len(text):
-            end = min(len(text), i + max_chars)
-            chunk = text[i:end]
+        text = item.get("content") or ""
+        pieces = chunk_tokens(text) if use_token_chunks() else chunk_text(text, max_chars, overlap)
+        for chunk in pieces:
             out.append({
                 "content": chunk,
                 "pageNumber": item.get("pageNumber"),
                 "sectionTitle": item.get("sectionTitle"),
             })
-            i = end - overlap
-            if i < 0:
-                i = 0
-            if end == len(text):
-                break
     return out
 
 def chunk_text(text: str, max_chars: int = 1800, overlap: int = 200) -> List[str]:
-    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    text = collapse_blank_lines(text)
     if not text:
         return []
 
-    chunks = []
-    i = 0
-    while i < len(text):
-        end = min(len(text), i + max_chars)
-        chunk = text[i:end]
-        chunks.append(chunk)
-        i = end - overlap
-        if i < 0: i = 0
-        if end == len(text): break
-    return chunks
+    n = len(text)
+    starts = range(0, max(n - overlap, 1), max_chars - overlap)
+    return [text[s:s + max_chars] for s in starts]
+
+_token_encoding = None
+
+def use_token_chunks() -> bool:
+    return tiktoken is not None and CHUNK_TOKENS > 0
+
+def chunker_id() -> str:
+    if use_token_chunks():
+        return f"tokens:{CHUNK_ENCODING}:{CHUNK_TOKENS}:{CHUNK_TOKEN_OVERLAP}"
+    return "chars"
 
-def aoai_embeddings(texts: List[str]) -> List[List[float]]:
-    url = f"{EMB_ENDPOINT}/openai/deployments/{EMB_DEPLOYMENT}/embeddings?api-version={AOAI_API_VERSION}"
-    headers = {"api-key": AOAI_KEY, "Content-Type": "application/json"}
+def chunk_tokens(text: str) -> List[str]:
+    global _token_encoding
+    text = collapse_blank_lines(text)
+    if not text:
+        return []
+    if _token_encoding is None:
+        _token_encoding = tiktoken.get_encoding(CHUNK_ENCODING)
+    tokens = _token_encoding.encode(text, disallowed_special=())
+    n = len(tokens)
+    starts = range(0, max(n - CHUNK_TOKEN_OVERLAP, 1), CHUNK_TOKENS - CHUNK_TOKEN_OVERLAP)
+    # errors="ignore" drops a character split at the window edge; the overlap keeps it whole.
+    return [
+        _token_encoding.decode_bytes(tokens[s:s + CHUNK_TOKENS]).decode("utf-8", errors="ignore")
+        for s in starts
+    ]
+
+def normalize(vec: List[float]) -> List[float]:
+    # Unit-length vectors let the index score with dotProduct instead of cosine.
+    norm = math.hypot(*vec)
+    return [x / norm for x in vec] if norm else vec
+
+_embedding_cache: "OrderedDict[bytes, array]" = OrderedDict()
+_embedding_disk = diskcache.Cache(EMB_CACHE_DIR) if EMB_CACHE_DIR and diskcache else None
+
+def embedding_key(text: str) -> bytes:
+    return hashlib.sha256((EMB_DEPLOYMENT or "").encode() + b"\0" + text.encode()).digest()
+
+def _remember_embedding(key: bytes, vec: array):
+    if EMB_CACHE_SIZE <= 0:
+        return
+    _embedding_cache[key] = vec
+    _embedding_cache.move_to_end(key)
+    if len(_embedding_cache) > EMB_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
+
+def _read_embeddings(keys: List[bytes]) -> List[Optional[bytes]]:
+    return [_embedding_disk.get(key) for key in keys]
+
+def _write_embeddings(items: List[Tuple[bytes, bytes]]):
+    for key, raw in items:
+        _embedding_disk.set(key, raw)
+
+async def cached_embeddings(keys: List[bytes]) -> List[Optional[List[float]]]:
+    found: List[Optional[List[float]]] = [None] * len(keys)
+    missing: List[int] = []
+    for i, key in enumerate(keys):
+        vec = _embedding_cache.get(key)
+        if vec is None:
+            missing.append(i)
+        else:
+            _embedding_cache.move_to_end(key)
+            found[i] = vec.tolist()
+    if missing and _embedding_disk is not None:
+        raws = await run_in_threadpool(_read_embeddings, [keys[i] for i in missing])
+        for i, raw in zip(missing, raws):
+            if raw is None:
+                continue
+            vec = array("f")
+            vec.frombytes(raw)
+            _remember_embedding(keys[i], vec)
+            found[i] = vec.tolist()
+    return found
+
+async def store_embeddings(keys: List[bytes], vectors: List[List[float]]):
+    vecs = [array("f", vector) for vector in vectors]
+    for key, vec in zip(keys, vecs):
+        _remember_embedding(key, vec)
+    if _embedding_disk is not None:
+        await run_in_threadpool(_write_embeddings, [(key, vec.tobytes()) for key, vec in zip(keys, vecs)])
+
+async def _embed_batch(texts: List[str]) -> List[List[float]]:
     payload = {"input": texts}
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
-    r.raise_for_status()
-    data = r.json()
-    return [item["embedding"] for item in data["data"]]
-
-def aoai_chat(messages: List[Dict[str, str]], temperature: float = 0.2) -> str:
-    url = f"{CHAT_ENDPOINT}/openai/deployments/{CHAT_DEPLOYMENT}/chat/completions?api-version={AOAI_API_VERSION}"
-    headers = {"api-key": AOAI_KEY, "Content-Type": "application/json"}
+    r = await http_request("POST", EMB_URL, headers=AOAI_HEADERS, content=orjson.dumps(payload), timeout=60)
+    data = orjson.loads(r.content)
+    return [normalize(item["embedding"]) for item in data["data"]]
+
+async def embedded_batches(texts: List[str]) -> AsyncIterator[Tuple[List[int], List[List[float]]]]:
+    keys = [embedding_key(t) for t in texts]
+    hits: List[int] = []
+    hit_vectors: List[List[float]] = []
+    misses: List[int] = []
+    for i, vec in enumerate(await cached_embeddings(keys)):
+        if vec is None:
+            misses.append(i)
+        else:
+            hits.append(i)
+            hit_vectors.append(vec)
+    if hits:
+        yield hits, hit_vectors
+
+    batches = (misses[i:i + EMBED_BATCH_SIZE] for i in range(0, len(misses), EMBED_BATCH_SIZE))
+
+    async def run(indices: List[int]) -> Tuple[List[int], List[List[float]]]:
+        vectors = await _embed_batch([texts[i] for i in indices])
+        await store_embeddings([keys[i] for i in indices], vectors)
+        return indices, vectors
+
+    pending = {asyncio.ensure_future(run(b)) for b in itertools.islice(batches, EMBED_CONCURRENCY)}
+    done = set()
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            while done:
+                task = done.pop()
+                nxt = next(batches, None)
+                if nxt:
+                    pending.add(asyncio.ensure_future(run(nxt)))
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, *done, return_exceptions=True)
+
+async def aoai_embeddings(texts: List[str]) -> List[List[float]]:
+    vectors: List[List[float]] = [None] * len(texts)
+    async for indices, batch in embedded_batches(texts):
+        for i, vec in zip(indices, batch):
+            vectors[i] = vec
+    return vectors
+
+async def aoai_chat_stream(messages: List[Dict[str, str]], temperature: float = 0.2) -> AsyncIterator[str]:
     payload = {
         "messages": messages,
-        "temperature": temperature
+        "temperature": temperature,
+        "stream": True
     }
-    r = requests.post(url, headers=headers, json=payload, timeout=90)
-    r.raise_for_status()
-    data = r.json()
-    return data["choices"][0]["message"]["content"]
+    async with http_stream("POST", CHAT_URL, headers=AOAI_HEADERS, content=orjson.dumps(payload), timeout=90) as r:
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            # Azure sends content-filter events with no choices; skip them.
+            for choice in orjson.loads(data).get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+
+async def aoai_chat(messages: List[Dict[str, str]], temperature: float = 0.2) -> str:
+    return "".join([delta async for delta in aoai_chat_stream(messages, temperature)])
 
-def upsert_chunks(
+def sse_delta(delta: str) -> str:
+    return f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+
+async def chat_events(messages: List[Dict[str, str]], temperature: float) -> AsyncIterator[str]:
+    # Waits for the first delta so upstream errors fail the request before the 200 is sent.
+    deltas = aoai_chat_stream(messages, temperature)
+    try:
+        first = await deltas.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            if first is not None:
+                yield sse_delta(first)
+            async for delta in deltas:
+                yield sse_delta(delta)
+        except Exception:
+            yield 'event: error\ndata: {"error": "Completion stream failed"}\n\n'
+            return
+        yield "data: [DONE]\n\n"
+
+    return events()
+
+def wants_event_stream(request: Request) -> bool:
+    return "text/event-stream" in request.headers.get("accept", "")
+
+async def embedded_records(chunks: List[Dict[str, Any]], cache_path: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+    async with ingest_cache_writer(cache_path) as write:
+        async for indices, batch in embedded_batches([c["content"] for c in chunks]):
+            records = [{**chunks[idx], "chunkId": idx, "contentVector": vector} for idx, vector in zip(indices, batch)]
+            await write(records)
+            for record in records:
+                yield record
+
+async def upsert_chunks(
     doc_id: str,
     filename: str,
     doc_type: str,
     blob_name: str,
     authority_level: Optional[str],
-    chunks: List[Dict[str, Any]]
-) -> None:
+    records: AsyncIterator[Dict[str, Any]]
+) -> int:
     if not search_client:
         raise HTTPException(500, "Search client not configured")
 
-    embeddings = aoai_embeddings([c["content"] for c in chunks])
-
-    docs = []
-    for idx, (chunk, emb) in enumerate(zip(chunks, embeddings)):
-        docs.append({
-            "id": f"{doc_id}_{idx}",
-            "docId": doc_id,
-            "filename": filename,
-            "docType": doc_type,
-            "blobName": blob_name,
-            "authorityLevel": authority_level or "standard",
-            "chunkId": idx,
-            "pageNumber": chunk.get("pageNumber"),
-            "sectionTitle": chunk.get("sectionTitle"),
-            "content": chunk["content"],
-            "contentVector": emb
-        })
-
-    # mergeOrUpload behavior
-    search_client.upload_documents(docs)
+    failed = []
+    count = 0
+    async with SearchIndexingBufferedSender(
+        endpoint=SEARCH_ENDPOINT,
+        index_name=SEARCH_INDEX,
+        credential=search_credential,
+        auto_flush_interval=5,
+        initial_batch_action_count=SEARCH_UPLOAD_BATCH,
+        on_error=failed.append,
+    ) as sender:
+        async for chunk in records:
+            await sender.upload_documents([{
+                "id": f"{doc_id}_{chunk['chunkId']}",
+                "docId": doc_id,
+                "filename": filename,
+                "docType": doc_type,
+                "blobName": blob_name,
+                "authorityLevel": authority_level or "standard",
+                "chunkId": chunk["chunkId"],
+                "pageNumber": chunk.get("pageNumber"),
+                "sectionTitle": chunk.get("sectionTitle"),
+                "content": chunk["content"],
+                "contentVector": chunk["contentVector"]
+            }])
+            count += 1
+
+    if failed:
+        raise HTTPException(500, f"Failed to index {len(failed)} of {count} chunks for docId={doc_id}")
+    return count
 
 AUTHORITY_PRIORITY = [
     "policy",
@@ -309,77 +694,85 @@ AUTHORITY_PRIORITY = [
     "unknown",
 ]
 
-def retrieve_chunks(doc_ids: List[str], query: str, k: int = 8) -> List[Dict[str, Any]]:
+def odata_literal(value: str) -> str:
+    # OData string literals escape a single quote by doubling it.
+    return "'" + value.replace("'", "''") + "'"
+
+def vector_search_args(query: str, qvec: List[float], k: int) -> Dict[str, Any]:
+    if SEMANTIC_RERANK:
+        return {
+            "search_text": query,
+            "query_type": "semantic",
+            "semantic_configuration_name": SEMANTIC_CONFIG,
+            "vector_queries": [{
+                "kind": "vector",
+                "vector": qvec,
+                "k": max(k, RERANK_CANDIDATES),
+                "fields": "contentVector"
+            }],
+            "top": k,
+        }
+    return {
+        "search_text": "",
+        "vector_queries": [{
+            "kind": "vector",
+            "vector": qvec,
+            "k": k,
+            "fields": "contentVector"
+        }],
+    }
+
+async def retrieve_chunks(doc_ids: List[str], query: str, k: int = 8) -> List[Dict[str, Any]]:
     if MOCK_AI:
         return []
     if not search_client:
         raise HTTPException(500, "Search client not configured")
 
-    qvec = aoai_embeddings([query])[0]
-    base_filter = " or ".join([f"docId eq '{d}'" for d in doc_ids]) if doc_ids else None
+    qvec = (await aoai_embeddings([query]))[0]
+    base_filter = f"search.in(docId, {odata_literal(','.join(doc_ids))}, ',')" if doc_ids else None
 
-    chunks = []
-    seen = set()
-    remaining = k
     per_tier = max(1, k // max(1, len(AUTHORITY_PRIORITY)))
 
-    for level in AUTHORITY_PRIORITY:
-        if remaining <= 0:
-            break
-        filters = [base_filter] if base_filter else []
-        filters.append(f"authorityLevel eq '{level}'")
-        tier_filter = " and ".join(filters)
-
-        results = search_client.search(
-            search_text="",
-            filter=tier_filter,
-            vector_queries=[{
-                "kind": "vector",
-                "vector": qvec,
-                "k": min(remaining, per_tier),
-                "fields": "contentVector"
-            }],
-            select=["content", "filename", "chunkId", "docId"]
+    async def search(filter: Optional[str], top: int, select: List[str]) -> List[Dict[str, Any]]:
+        results = await search_client.search(
+            filter=filter,
+            select=select,
+            **vector_search_args(query, qvec, top)
         )
-
-        for r in results:
-            key = f"{r['docId']}_{r['chunkId']}"
-            if key in seen:
-                continue
-            seen.add(key)
-            chunks.append({
-                "docId": r["docId"],
-                "filename": r["filename"],
-                "chunkId": int(r["chunkId"]),
-                "content": r["content"],
-            })
-            remaining -= 1
-            if remaining <= 0:
-                break
-
-    if remaining > 0:
-        results = search_client.search(
-            search_text="",
-            filter=base_filter,
-            vector_queries=[{
-                "kind": "vector",
-                "vector": qvec,
-                "k": remaining,
-                "fields": "contentVector"
-            }],
-            select=["content", "filename", "chunkId", "docId"]
+        return [r async for r in results]
+
+    fields = ["content", "filename", "chunkId", "docId"]
+    if SEMANTIC_RERANK:
+        fallback = await search(base_filter, RERANK_CANDIDATES, fields + ["authorityLevel"])
+        tiers = [
+            [r for r in fallback if r.get("authorityLevel") == level][:per_tier]
+            for level in AUTHORITY_PRIORITY
+        ]
+    else:
+        tier_filters = [
+            " and ".join(([base_filter] if base_filter else []) + [f"authorityLevel eq '{level}'"])
+            for level in AUTHORITY_PRIORITY
+        ]
+        *tiers, fallback = await asyncio.gather(
+            *(search(f, per_tier, fields) for f in tier_filters),
+            search(base_filter, k, fields),
         )
-        for r in results:
-            key = f"{r['docId']}_{r['chunkId']}"
-            if key in seen:
-                continue
-            seen.add(key)
-            chunks.append({
-                "docId": r["docId"],
-                "filename": r["filename"],
-                "chunkId": int(r["chunkId"]),
-                "content": r["content"],
-            })
+
+    chunks = []
+    seen = set()
+    for r in itertools.chain(*tiers, fallback):
+        if len(chunks) >= k:
+            break
+        key = f"{r['docId']}_{r['chunkId']}"
+        if key in seen:
+            continue
+        seen.add(key)
+        chunks.append({
+            "docId": r["docId"],
+            "filename": r["filename"],
+            "chunkId": int(r["chunkId"]),
+            "content": r["content"],
+        })
 
     return chunks
 
@@ -392,14 +785,28 @@ def format_context(chunks: List[Dict[str, Any]]) -> str:
         )
     return "\n\n---\n\n".join(parts)
 
-def validate_model(model_cls, data: Any):
+_CODE_FENCE = re.compile(r"^```[A-Za-z]*\s*|\s*```$")
+
+def parse_model_json(out: str) -> Any:
+    text = _CODE_FENCE.sub("", out.strip())
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json_repair.loads(text)
+
+def validate_model(adapter: TypeAdapter, data: Any) -> Any:
+    # The dump carries the coerced values and drops unknown keys.
     try:
-        if hasattr(model_cls, "model_validate"):
-            return model_cls.model_validate(data)
-        return model_cls.parse_obj(data)
+        return adapter.dump_python(adapter.validate_python(data))
     except Exception as e:
         raise HTTPException(500, f"Model returned invalid schema: {str(e)}")
 
+def validate_model_json(adapter: TypeAdapter, out: str) -> Any:
+    try:
+        return adapter.dump_python(adapter.validate_json(out))
+    except ValidationError:
+        return validate_model(adapter, parse_model_json(out))
+
 def mock_sop(doc_ids: List[str], style: str) -> Dict[str, Any]:
     return {
         "title": f"Mock SOP ({style})",
@@ -491,112 +898,138 @@ def mock_process(doc_ids: List[str], include_raci: bool) -> Dict[str, Any]:
         "docIds": doc_ids,
     }
 
-# ---------- Routes ----------
-@app.post("/ingest")
-def ingest(req: IngestRequest):
-    b = download_bytes(req.blobUrl)
-    extracted = extract_chunks(req.docType, b)
-    chunks = chunk_text_with_meta(extracted)
-
-    if not chunks:
-        raise HTTPException(400, "No extractable text found")
-
-    if not MOCK_AI:
-        upsert_chunks(
-            req.docId,
-            req.filename,
-            req.docType,
-            req.blobName,
-            req.authorityLevel,
-            chunks
-        )
-    return {"ok": True, "docId": req.docId, "chunks": len(chunks)}
+_doc_meta_cache: "TTLCache[str, Dict[str, Any]]" = TTLCache(maxsize=10_000, ttl=META_CACHE_TTL)
+_source_chunk_cache: "TTLCache[Tuple[str, int], Dict[str, Any]]" = TTLCache(maxsize=10_000, ttl=META_CACHE_TTL)
 
-@app.post("/generate/sop")
-def generate_sop(req: GenerateSopRequest):
-    if MOCK_AI:
-        mock = mock_sop(req.docIds, req.style)
-        validated = validate_model(SopResponse, mock)
-        return validated.model_dump() if hasattr(validated, "model_dump") else validated.dict()
-    chunks = retrieve_chunks(
-        req.docIds,
-        query="Create an SOP from these meeting notes and documents. Focus on factual steps, owners, tools, and outputs."
-    )
-    context = format_context(chunks)
+def forget_doc(doc_id: str):
+    _doc_meta_cache.pop(doc_id, None)
+    for key in [k for k in _source_chunk_cache if k[0] == doc_id]:
+        _source_chunk_cache.pop(key, None)
 
-    system = (
-        "You are an operations analyst. You MUST ground your output in the provided SOURCE CONTEXT.\n"
-        "You MUST NOT invent steps. If information is missing, write it as 'Unknown' or add it to exceptions/missing info.\n"
-        "Return STRICT JSON ONLY. No markdown. No extra keys.\n"
-        "Every step MUST include at least one source reference taken from the SOURCE CONTEXT anchors.\n"
-        "Each source must include a short direct quote (<=25 words) copied from the context."
-    )
+# ---------- Prompts ----------
+SOP_SYSTEM = (
+    "You are an operations analyst. You MUST ground your output in the provided SOURCE CONTEXT.\n"
+    "You MUST NOT invent steps. If information is missing, write it as 'Unknown' or add it to exceptions/missing info.\n"
+    "Return STRICT JSON ONLY. No markdown. No extra keys.\n"
+    "Every step MUST include at least one source reference taken from the SOURCE CONTEXT anchors.\n"
+    "Each source must include a short direct quote (<=25 words) copied from the context."
+)
 
-    user = f"""
+SOP_USER_TEMPLATE = Template("""
 Create an SOP using ONLY the SOURCE CONTEXT.
 
 Return JSON with EXACTLY this schema:
-{{
+{
   "title": str,
   "purpose": str,
   "scope": str,
-  "roles": [{{"role": str, "responsibilities": [str]}}],
+  "roles": [{"role": str, "responsibilities": [str]}],
   "prerequisites": [str],
-  "steps": [{{"step": int, "action": str, "owner": str, "tools": [str], "output": str, "sources": [{{"docId": str, "filename": str, "chunkId": int, "quote": str}}]}}],
+  "steps": [{"step": int, "action": str, "owner": str, "tools": [str], "output": str, "sources": [{"docId": str, "filename": str, "chunkId": int, "quote": str}]}],
   "exceptions": [str],
   "audit_checklist": [str]
-}}
+}
 
 Rules:
 - steps[].sources must reference anchors from SOURCE CONTEXT (docId, filename, chunkId must match).
 - quote must be a short exact excerpt from that chunk that supports the step.
 - If owner/tool/output is not stated, set it to "Unknown" and cite the closest supporting text.
 
-Style: {req.style}
+Style: $style
 
 SOURCE CONTEXT:
-{context}
-"""
+$context
+""")
+
+PROCESS_SYSTEM = (
+    "You are an operations analyst. You MUST ground your output in the provided SOURCE CONTEXT.\n"
+    "You MUST NOT invent steps. If information is missing, write 'Unknown' or add it to edge_cases/missing info.\n"
+    "Return STRICT JSON ONLY. No markdown. No extra keys.\n"
+    "Every process step MUST include at least one source reference taken from the SOURCE CONTEXT anchors.\n"
+    "Each source must include a short direct quote (<=25 words) copied from the context."
+)
+
+PROCESS_USER_TEMPLATE = Template("""
+Create a Process Document using ONLY the SOURCE CONTEXT.
+Return JSON with exactly this schema:
+{
+  "title": str,
+  "overview": str,
+  "trigger": str,
+  "inputs": [str],
+  "outputs": [str],
+  "systems": [str],
+  "process_steps": [{"step": int, "what_happens": str, "owner": str, "sources": [{"docId": str, "filename": str, "chunkId": int, "quote": str}]}],
+  "edge_cases": [str],
+  "metrics": [str],
+  "raci": [{"activity": str, "r": str, "a": str, "c": [str], "i": [str]}]
+}
 
-    out = aoai_chat([
-        {"role": "system", "content": system},
-        {"role": "user", "content": user}
-    ], temperature=0.1)
-    try:
-        parsed = json.loads(out)
-        validated = validate_model(SopResponse, parsed)
-        return validated.model_dump() if hasattr(validated, "model_dump") else validated.dict()
-    except Exception:
-        raise HTTPException(500, f"Model returned non-JSON output: {out[:300]}")
+Rules:
+- process_steps[].sources must reference anchors from SOURCE CONTEXT (docId, filename, chunkId must match).
+- quote must be a short exact excerpt from that chunk that supports the step.
+- If owner is not stated, set owner to "Unknown" and cite the closest supporting text.
 
-@app.post("/generate/process_verified")
-def generate_process_verified(req: GenerateProcessRequest):
-    if MOCK_AI:
-        return {
-            "process": mock_process(req.docIds, req.includeRaci),
-            "verification": {
-                "issues": [],
-                "conflicts": [],
-                "missing_info": [],
-                "overall_confidence": "low"
-            },
-        }
+If includeRaci is false, return raci as an empty list.
 
-    process_doc = generate_process(req)
+includeRaci: $include_raci
 
-    chunks = retrieve_chunks(
-        req.docIds,
-        query="Verify process steps against these documents. Identify missing evidence, conflicts, and ambiguous steps."
-    )
-    context = format_context(chunks)
+SOURCE CONTEXT:
+$context
+""")
 
-    verifier_system = (
-        "You are a strict QA auditor.\n"
-        "Your job: verify each process step is supported by its cited sources.\n"
-        "Return STRICT JSON ONLY. No markdown."
-    )
+VERIFY_SOP_SYSTEM = (
+    "You are a strict QA auditor.\n"
+    "Your job: verify each SOP step is supported by its cited sources.\n"
+    "Return STRICT JSON ONLY. No markdown."
+)
 
-    verifier_user = f"""
+VERIFY_SOP_USER_TEMPLATE = Template("""
+You will be given:
+1) SOURCE CONTEXT
+2) A generated SOP JSON
+
+Tasks:
+- For each step, check if the cited quotes actually support the step action/owner/tool/output.
+- Flag steps with missing/weak evidence.
+- Flag conflicts if different sources imply different instructions.
+- Identify missing information that prevents accuracy.
+
+Return JSON with EXACTLY this schema:
+{
+  "issues": [
+    {
+      "type": "missing_source" | "weak_evidence" | "conflict" | "ambiguous",
+      "step": int,
+      "details": str,
+      "recommendation": str
+    }
+  ],
+  "conflicts": [
+    {
+      "topic": str,
+      "sources": [{"docId": str, "filename": str, "chunkId": int, "quote": str}],
+      "recommendation": str
+    }
+  ],
+  "missing_info": [str],
+  "overall_confidence": "low" | "medium" | "high"
+}
+
+SOP JSON:
+$sop
+
+SOURCE CONTEXT:
+$context
+""")
+
+VERIFY_PROCESS_SYSTEM = (
+    "You are a strict QA auditor.\n"
+    "Your job: verify each process step is supported by its cited sources.\n"
+    "Return STRICT JSON ONLY. No markdown."
+)
+
+VERIFY_PROCESS_USER_TEMPLATE = Template("""
 You will be given:
 1) SOURCE CONTEXT
 2) A generated Process Document JSON
@@ -608,42 +1041,124 @@ Tasks:
 - Identify missing information that prevents accuracy.
 
 Return JSON with EXACTLY this schema:
-{{
+{
   "issues": [
-    {{
+    {
       "type": "missing_source" | "weak_evidence" | "conflict" | "ambiguous",
       "step": int,
       "details": str,
       "recommendation": str
-    }}
+    }
   ],
   "conflicts": [
-    {{
+    {
       "topic": str,
-      "sources": [{{"docId": str, "filename": str, "chunkId": int, "quote": str}}],
+      "sources": [{"docId": str, "filename": str, "chunkId": int, "quote": str}],
       "recommendation": str
-    }}
+    }
   ],
   "missing_info": [str],
   "overall_confidence": "low" | "medium" | "high"
-}}
+}
 
 PROCESS DOC JSON:
-{json.dumps(process_doc)}
+$process_doc
 
 SOURCE CONTEXT:
-{context}
-"""
+$context
+""")
+
+# ---------- Routes ----------
+@app.post("/ingest")
+async def ingest(req: IngestRequest):
+    f, digest = await download_blob(req.blobUrl)
+    cache_path = None if MOCK_AI else ingest_cache_path(digest, req.docType)
+
+    if cache_path and os.path.exists(cache_path) and await run_in_threadpool(valid_cache_entry, cache_path):
+        f.close()
+        records = cached_records(cache_path)
+    else:
+        with f:
+            extracted = await run_in_threadpool(extract_chunks, req.docType, f)
+        chunks = await run_in_threadpool(chunk_text_with_meta, extracted)
+
+        if not chunks:
+            raise HTTPException(400, "No extractable text found")
+        if MOCK_AI:
+            return {"ok": True, "docId": req.docId, "chunks": len(chunks)}
+        records = embedded_records(chunks, cache_path)
+
+    count = await upsert_chunks(
+        req.docId,
+        req.filename,
+        req.docType,
+        req.blobName,
+        req.authorityLevel,
+        records
+    )
+    forget_doc(req.docId)
+    return {"ok": True, "docId": req.docId, "chunks": count}
+
+async def sop_messages(req: GenerateSopRequest) -> Tuple[List[Dict[str, str]], str]:
+    chunks = await retrieve_chunks(
+        req.docIds,
+        query="Create an SOP from these meeting notes and documents. Focus on factual steps, owners, tools, and outputs."
+    )
+    context = format_context(chunks)
+
+    user = SOP_USER_TEMPLATE.substitute(style=req.style, context=context)
+
+    return [
+        {"role": "system", "content": SOP_SYSTEM},
+        {"role": "user", "content": user}
+    ], context
+
+async def create_sop(req: GenerateSopRequest) -> Tuple[Dict[str, Any], str]:
+    if MOCK_AI:
+        return validate_model(SOP_ADAPTER, mock_sop(req.docIds, req.style)), ""
+
+    messages, context = await sop_messages(req)
+    out = await aoai_chat(messages, temperature=0.1)
+    try:
+        return validate_model_json(SOP_ADAPTER, out), context
+    except Exception:
+        raise HTTPException(500, f"Model returned non-JSON output: {out[:300]}")
+
+@app.post("/generate/sop")
+async def generate_sop(req: GenerateSopRequest, request: Request):
+    if not MOCK_AI and wants_event_stream(request):
+        messages, _ = await sop_messages(req)
+        return StreamingResponse(await chat_events(messages, temperature=0.1), media_type="text/event-stream")
+    result, _ = await create_sop(req)
+    return result
+
+@app.post("/generate/process_verified")
+async def generate_process_verified(req: GenerateProcessRequest):
+    if MOCK_AI:
+        return {
+            "process": mock_process(req.docIds, req.includeRaci),
+            "verification": {
+                "issues": [],
+                "conflicts": [],
+                "missing_info": [],
+                "overall_confidence": "low"
+            },
+        }
 
-    verification_out = aoai_chat([
-        {"role": "system", "content": verifier_system},
+    process_doc, context = await create_process(req)
+
+    verifier_user = VERIFY_PROCESS_USER_TEMPLATE.substitute(
+        process_doc=orjson.dumps(process_doc).decode(),
+        context=context,
+    )
+
+    verification_out = await aoai_chat([
+        {"role": "system", "content": VERIFY_PROCESS_SYSTEM},
         {"role": "user", "content": verifier_user}
     ], temperature=0.0)
 
     try:
-        verification = json.loads(verification_out)
-        verification = validate_model(VerificationResponse, verification)
-        verification = verification.model_dump() if hasattr(verification, "model_dump") else verification.dict()
+        verification = validate_model_json(VERIFICATION_ADAPTER, verification_out)
     except Exception:
         raise HTTPException(500, f"Verifier returned non-JSON output: {verification_out[:300]}")
 
@@ -653,7 +1168,7 @@ SOURCE CONTEXT:
     }
 
 @app.get("/source-chunk")
-def source_chunk(docId: str, chunkId: int):
+async def source_chunk(docId: str, chunkId: int):
     if MOCK_AI:
         return {
             "docId": docId,
@@ -661,53 +1176,63 @@ def source_chunk(docId: str, chunkId: int):
             "chunkId": chunkId,
             "content": "Mock source chunk content for demo highlighting.",
         }
+    cached = _source_chunk_cache.get((docId, chunkId))
+    if cached is not None:
+        return cached
     if not search_client:
         raise HTTPException(500, "Search client not configured")
     try:
-        doc = search_client.get_document(key=f"{docId}_{chunkId}")
+        doc = await search_client.get_document(key=f"{docId}_{chunkId}")
     except Exception:
         raise HTTPException(404, "Source chunk not found")
 
-    return {
+    chunk = {
         "docId": doc.get("docId"),
         "filename": doc.get("filename"),
         "chunkId": doc.get("chunkId"),
         "content": doc.get("content"),
     }
+    _source_chunk_cache[(docId, chunkId)] = chunk
+    return chunk
 
 @app.get("/doc-meta")
-def get_doc_meta(docId: str = Query(...)):
+async def get_doc_meta(docId: str = Query(...)):
     """
     Returns metadata (blobName, filename, docType) for a given docId.
     We query one chunk and reuse its metadata.
     """
+    cached = _doc_meta_cache.get(docId)
+    if cached is not None:
+        return cached
     if not search_client:
         raise HTTPException(500, "Search client not configured")
 
-    results = search_client.search(
+    results = await search_client.search(
         search_text="",
-        filter=f"docId eq '{docId}'",
+        filter=f"docId eq {odata_literal(docId)}",
         select=["docId", "filename", "docType", "blobName", "chunkId"],
         top=1
     )
 
     first = None
-    for r in results:
+    async for r in results:
         first = r
         break
 
     if not first:
         raise HTTPException(404, f"No document found for docId={docId}")
 
-    return {
+    meta = {
         "docId": first.get("docId"),
         "filename": first.get("filename"),
         "docType": first.get("docType"),
         "blobName": first.get("blobName")
     }
+    _doc_meta_cache[docId] = meta
+    return meta
 
 @app.post("/generate/sop_verified")
-def generate_sop_verified(req: GenerateSopRequest):
+async def generate_sop_verified(req: GenerateSopRequest):
     if MOCK_AI:
         return {
             "sop": mock_sop(req.docIds, req.style),
@@ -719,68 +1244,20 @@ def generate_sop_verified(req: GenerateSopRequest):
             },
         }
 
-    sop = generate_sop(req)
+    sop, context = await create_sop(req)
 
-    chunks = retrieve_chunks(
-        req.docIds,
-        query="Verify SOP steps against these documents. Identify missing evidence, conflicts, and ambiguous steps."
+    verifier_user = VERIFY_SOP_USER_TEMPLATE.substitute(
+        sop=orjson.dumps(sop).decode(),
+        context=context,
     )
-    context = format_context(chunks)
-
-    verifier_system = (
-        "You are a strict QA auditor.\n"
-        "Your job: verify each SOP step is supported by its cited sources.\n"
-        "Return STRICT JSON ONLY. No markdown."
-    )
-
-    verifier_user = f"""
-You will be given:
-1) SOURCE CONTEXT
-2) A generated SOP JSON
-
-Tasks:
-- For each step, check if the cited quotes actually support the step action/owner/tool/output.
-- Flag steps with missing/weak evidence.
-- Flag conflicts if different sources imply different instructions.
-- Identify missing information that prevents accuracy.
 
-Return JSON with EXACTLY this schema:
-{{
-  "issues": [
-    {{
-      "type": "missing_source" | "weak_evidence" | "conflict" | "ambiguous",
-      "step": int,
-      "details": str,
-      "recommendation": str
-    }}
-  ],
-  "conflicts": [
-    {{
-      "topic": str,
-      "sources": [{{"docId": str, "filename": str, "chunkId": int, "quote": str}}],
-      "recommendation": str
-    }}
-  ],
-  "missing_info": [str],
-  "overall_confidence": "low" | "medium" | "high"
-}}
-
-SOP JSON:
-{json.dumps(sop)}
-
-SOURCE CONTEXT:
-{context}
-"""
-
-    verification_out = aoai_chat([
-        {"role": "system", "content": verifier_system},
+    verification_out = await aoai_chat([
+        {"role": "system", "content": VERIFY_SOP_SYSTEM},
         {"role": "user", "content": verifier_user}
     ], temperature=0.0)
 
     try:
-        verification = json.loads(verification_out)
-        verification = validate_model(VerificationResponse, verification)
-        verification = verification.model_dump() if hasattr(verification, "model_dump") else verification.dict()
+        verification = validate_model_json(VERIFICATION_ADAPTER, verification_out)
     except Exception:
         raise HTTPException(500, f"Verifier returned non-JSON output: {verification_out[:300]}")
 
@@ -789,59 +1266,45 @@ SOURCE CONTEXT:
         "verification": verification
     }
 
-@app.post("/generate/process")
-def generate_process(req: GenerateProcessRequest):
-    if MOCK_AI:
-        mock = mock_process(req.docIds, req.includeRaci)
-        validated = validate_model(ProcessResponse, mock)
-        return validated.model_dump() if hasattr(validated, "model_dump") else validated.dict()
-    chunks = retrieve_chunks(
+async def process_messages(req: GenerateProcessRequest) -> Tuple[List[Dict[str, str]], str]:
+    chunks = await retrieve_chunks(
         req.docIds,
         query="Create a process document from these notes and files. Focus on triggers, inputs/outputs, systems, steps, owners, and exceptions."
     )
     context = format_context(chunks)
-    system = (
-        "You are an operations analyst. You MUST ground your output in the provided SOURCE CONTEXT.\n"
-        "You MUST NOT invent steps. If information is missing, write 'Unknown' or add it to edge_cases/missing info.\n"
-        "Return STRICT JSON ONLY. No markdown. No extra keys.\n"
-        "Every process step MUST include at least one source reference taken from the SOURCE CONTEXT anchors.\n"
-        "Each source must include a short direct quote (<=25 words) copied from the context."
-    )
-    user = f"""
-Create a Process Document using ONLY the SOURCE CONTEXT.
-Return JSON with exactly this schema:
-{{
-  "title": str,
-  "overview": str,
-  "trigger": str,
-  "inputs": [str],
-  "outputs": [str],
-  "systems": [str],
-  "process_steps": [{{"step": int, "what_happens": str, "owner": str, "sources": [{{"docId": str, "filename": str, "chunkId": int, "quote": str}}]}}],
-  "edge_cases": [str],
-  "metrics": [str],
-  "raci": [{{"activity": str, "r": str, "a": str, "c": [str], "i": [str]}}]
-}}
-
-Rules:
-- process_steps[].sources must reference anchors from SOURCE CONTEXT (docId, filename, chunkId must match).
-- quote must be a short exact excerpt from that chunk that supports the step.
-- If owner is not stated, set owner to "Unknown" and cite the closest supporting text.
-
-If includeRaci is false, return raci as an empty list.
+    user = PROCESS_USER_TEMPLATE.substitute(include_raci=req.includeRaci, context=context)
+    return [
+        {"role": "system", "content": PROCESS_SYSTEM},
+        {"role": "user", "content": user}
+    ], context
 
-includeRaci: {req.includeRaci}
+async def create_process(req: GenerateProcessRequest) -> Tuple[Dict[str, Any], str]:
+    if MOCK_AI:
+        return validate_model(PROCESS_ADAPTER, mock_process(req.docIds, req.includeRaci)), ""
 
-SOURCE CONTEXT:
-{context}
-"""
-    out = aoai_chat([
-        {"role": "system", "content": system},
-        {"role": "user", "content": user}
-    ], temperature=0.1)
+    messages, context = await process_messages(req)
+    out = await aoai_chat(messages, temperature=0.1)
     try:
-        parsed = json.loads(out)
-        validated = validate_model(ProcessResponse, parsed)
-        return validated.model_dump() if hasattr(validated, "model_dump") else validated.dict()
+        return validate_model_json(PROCESS_ADAPTER, out), context
     except Exception:
         raise HTTPException(500, f"Model returned non-JSON output: {out[:300]}")
+
+@app.post("/generate/process")
+async def generate_process(req: GenerateProcessRequest, request: Request):
+    if not MOCK_AI and wants_event_stream(request):
+        messages, _ = await process_messages(req)
+        return StreamingResponse(await chat_events(messages, temperature=0.1), media_type="text/event-stream")
+    result, _ = await create_process(req)
+    return result
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("AI_HOST", "0.0.0.0"),
+        port=int(os.getenv("AI_PORT", "8000")),
+        workers=AI_WORKERS,
+        loop="uvloop",
+        http="httptools",
+    )